@@ -1,10 +1,28 @@
 import sys
 import os
 import json
+import shelve
 import fitz  # PyMuPDF
+import numpy as np
 import pikepdf
 from pikepdf import Name, Dictionary, Array, Pdf, Stream
 import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
+from rapidfuzz import fuzz, process
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sparse_dot_topn import awesome_cossim_topn
+
+# Precompiled content-stream patterns (hot path during tagging).
+# Bytes patterns so streams never round-trip through str.
+TJ_PATTERN = re.compile(rb'\((.*?)\)\s*Tj')
+TJ_ARRAY_PATTERN = re.compile(rb'\[(.*?)\]\s*TJ')
+STRING_PATTERN = re.compile(rb'\((.*?)\)')
+BT_ET_PATTERN = re.compile(rb'(BT\s+.*?ET)', re.DOTALL)
+
+# On-disk cache for find_tables results, keyed by file path + mtime
+TABLE_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".table_cache")
 
 def detect_tables(page):
     """Detect tables on a page using PyMuPDF's table finder."""
@@ -63,22 +81,76 @@ def detect_tables(page):
         print(f"Warning: Table detection failed: {e}")
         return []
 
-def analyze_layout(input_path):
-    """Analyzes PDF layout and returns structural items with coordinates."""
-    doc = fitz.open(input_path)
-    structure_items = []
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
+def _table_cache_key(input_path, page_num):
+    """Cache key tying an entry to the file's path and mtime."""
+    mtime = os.path.getmtime(input_path)
+    return f"{os.path.abspath(input_path)}:{mtime}:{page_num}"
+
+
+def lookup_cached_tables(input_path, page_num):
+    """Read-only lookup of a page's cached find_tables result.
+
+    shelve has no cross-process locking, so workers only ever read;
+    the parent process writes new entries alone once the page map is
+    done. Returns None on a miss or any cache error.
+    """
+    try:
+        with shelve.open(TABLE_CACHE_PATH, flag='r') as cache:
+            return cache.get(_table_cache_key(input_path, page_num))
+    except Exception:
+        return None
+
+
+def store_cached_tables(input_path, detected):
+    """Write freshly detected tables to the cache.
+
+    Called from the parent process only, after all workers have
+    finished, so there is never more than one writer.
+    """
+    try:
+        with shelve.open(TABLE_CACHE_PATH) as cache:
+            for page_num, tables in detected.items():
+                cache[_table_cache_key(input_path, page_num)] = tables
+    except Exception:
+        pass
+
+
+# Per-worker-process document handle; PyMuPDF Documents cannot be
+# shared across processes, but one open per worker beats one per page
+_worker_doc = None
+_worker_doc_path = None
+
+
+def _get_worker_doc(input_path):
+    """Return this worker's document, opening it on first use."""
+    global _worker_doc, _worker_doc_path
+    if _worker_doc is None or _worker_doc_path != input_path:
+        if _worker_doc is not None:
+            _worker_doc.close()
+        _worker_doc = fitz.open(input_path)
+        _worker_doc_path = input_path
+    return _worker_doc
+
+
+def _analyze_page(input_path, page_num):
+    """Analyze a single page's layout in a worker process."""
+    doc = _get_worker_doc(input_path)
+    try:
+        page = doc.load_page(page_num)
         height = page.rect.height
-        
+
         # Collect all items for this page (will sort later)
         page_items = []
-        
-        # Detect tables first
-        tables = detect_tables(page)
+
+        # Detect tables first. The cache probe is read-only here;
+        # fresh results are returned so the parent can store them.
+        tables = lookup_cached_tables(input_path, page_num)
+        fresh_tables = None
+        if tables is None:
+            tables = detect_tables(page)
+            fresh_tables = tables
         table_bboxes = [t["bbox"] for t in tables]
-        
+
         # Add tables to page items
         for table in tables:
             page_items.append({
@@ -86,41 +158,36 @@ def analyze_layout(input_path):
                 "type": "Table",
                 "table_data": table["cells"],
                 "bbox": table["bbox"],
-                "rect": [table["bbox"][0], height - table["bbox"][3], 
-                        table["bbox"][2] - table["bbox"][0], 
+                "rect": [table["bbox"][0], height - table["bbox"][3],
+                        table["bbox"][2] - table["bbox"][0],
                         table["bbox"][3] - table["bbox"][1]],
                 "y_pos": table["bbox"][1]  # Top Y coordinate for sorting
             })
-        
+
         # Get text blocks (excluding table regions)
         try:
             blocks = page.get_text("dict")["blocks"]
         except Exception:
-            continue
-            
-        for b in blocks:
-            if "lines" not in b:
-                continue
-            
-            # Check if this block is inside a table
-            block_bbox = b["bbox"]
-            is_in_table = False
-            for table_bbox in table_bboxes:
-                # Check if block is inside table bbox
-                if (block_bbox[0] >= table_bbox[0] - 5 and 
-                    block_bbox[1] >= table_bbox[1] - 5 and
-                    block_bbox[2] <= table_bbox[2] + 5 and 
-                    block_bbox[3] <= table_bbox[3] + 5):
-                    is_in_table = True
-                    break
-            
-            if is_in_table:
-                continue  # Skip blocks that are part of tables
-                
+            return [], fresh_tables
+
+        text_blocks = [b for b in blocks if "lines" in b]
+
+        # Drop blocks that are part of tables. One broadcasted NumPy
+        # comparison replaces the per-block/per-table Python loop.
+        if text_blocks and table_bboxes:
+            block_arr = np.asarray([b["bbox"] for b in text_blocks], dtype=np.float32)
+            table_arr = np.asarray(table_bboxes, dtype=np.float32)
+            inside = ((block_arr[:, None, 0] >= table_arr[:, 0] - 5) &
+                      (block_arr[:, None, 1] >= table_arr[:, 1] - 5) &
+                      (block_arr[:, None, 2] <= table_arr[:, 2] + 5) &
+                      (block_arr[:, None, 3] <= table_arr[:, 3] + 5)).any(axis=1)
+            text_blocks = [b for b, in_table in zip(text_blocks, inside) if not in_table]
+
+        for b in text_blocks:
             block_text = ""
             max_font_size = 0
             is_bold = False
-            
+
             # Combine lines and find dominant styling
             for line in b["lines"]:
                 for span in line["spans"]:
@@ -128,18 +195,18 @@ def analyze_layout(input_path):
                     max_font_size = max(max_font_size, span["size"])
                     if span["flags"] & 2: # Bold flag
                         is_bold = True
-            
+
             block_text = block_text.strip()
             if not block_text:
                 continue
-                
+
             # Determine Tag Type
             tag_type = "P"
             if max_font_size > 14:
                 tag_type = "H1"
             elif max_font_size > 12 or is_bold:
                 tag_type = "H2"
-            
+
             rect = b["bbox"]
             page_items.append({
                 "page": page_num + 1,
@@ -149,41 +216,67 @@ def analyze_layout(input_path):
                 "bbox": rect,
                 "y_pos": rect[1]  # Top Y coordinate for sorting
             })
-        
+
         # Sort page items by Y position (top to bottom)
         # In PDF coordinates, Y increases from bottom to top, so we sort ascending
-        page_items.sort(key=lambda item: item["y_pos"])
-        
+        page_items.sort(key=itemgetter("y_pos"))
+
         # Remove y_pos before adding to structure_items
         for item in page_items:
             del item["y_pos"]
-            structure_items.append(item)
-            
+
+        return page_items, fresh_tables
+    finally:
+        # Empty the MuPDF store so parsed page data doesn't
+        # accumulate across pages on very large documents
+        fitz.TOOLS.store_shrink(100)
+
+
+def analyze_layout(input_path):
+    """Analyzes PDF layout and returns structural items with coordinates."""
+    doc = fitz.open(input_path)
+    num_pages = len(doc)
     doc.close()
+
+    structure_items = []
+
+    # Pages are independent, so analyze them in parallel. Workers are
+    # capped at 8 since per-page work stops scaling much beyond that.
+    max_workers = min(os.cpu_count() or 1, 8)
+    freshly_detected = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map preserves page order
+        for page_num, (page_items, fresh_tables) in enumerate(
+                executor.map(_analyze_page, repeat(input_path), range(num_pages))):
+            structure_items.extend(page_items)
+            if fresh_tables is not None:
+                freshly_detected[page_num] = fresh_tables
+
+    # Single writer: only the parent populates the table cache
+    if freshly_detected:
+        store_cached_tables(input_path, freshly_detected)
+
     return structure_items
 
 
 def extract_text_from_bt_et(bt_et_block):
-    """Extract visible text from a BT...ET block."""
+    """Extract visible text from a BT...ET block of raw stream bytes."""
     # Look for text showing operators: Tj, TJ, ', "
     text_parts = []
     
     # Tj operator: (text) Tj
-    tj_pattern = r'\((.*?)\)\s*Tj'
-    for match in re.finditer(tj_pattern, bt_et_block):
+    for match in TJ_PATTERN.finditer(bt_et_block):
         text_parts.append(match.group(1))
-    
+
     # TJ operator: [(text)] TJ or [(text) num (text)] TJ
-    tj_array_pattern = r'\[(.*?)\]\s*TJ'
-    for match in re.finditer(tj_array_pattern, bt_et_block):
+    for match in TJ_ARRAY_PATTERN.finditer(bt_et_block):
         array_content = match.group(1)
         # Extract strings from array
-        string_pattern = r'\((.*?)\)'
-        for string_match in re.finditer(string_pattern, array_content):
+        for string_match in STRING_PATTERN.finditer(array_content):
             text_parts.append(string_match.group(1))
     
-    # Combine and clean
-    combined_text = ' '.join(text_parts).strip()
+    # Combine and clean; only the extracted strings are decoded
+    combined_text = b' '.join(text_parts).decode('latin-1').strip()
     return combined_text
 
 def find_best_match(text_block_text, items_for_page, used_indices):
@@ -191,113 +284,194 @@ def find_best_match(text_block_text, items_for_page, used_indices):
     if not text_block_text:
         return None
     
-    best_match_idx = None
-    best_similarity = 0
-    
+    choices = {}
     for idx, item in enumerate(items_for_page):
         if idx in used_indices:
             continue
-        
+
         if item["type"] == "Table":
             continue  # Skip tables for now
-        
+
         item_text = item.get("text", "").strip()
         if not item_text:
             continue
-        
-        # Simple similarity: check if one contains the other or starts with
-        text_lower = text_block_text.lower()
-        item_lower = item_text.lower()
-        
-        # Exact match
-        if text_lower == item_lower:
-            return idx
-        
-        # Check if text block contains item text (for partial matches)
-        if item_lower in text_lower or text_lower in item_lower:
-            # Calculate similarity score
-            similarity = len(set(text_lower.split()) & set(item_lower.split())) / max(len(text_lower.split()), len(item_lower.split()))
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match_idx = idx
-        
-        # Check if starts with (for headings)
-        if text_lower.startswith(item_lower[:min(20, len(item_lower))]):
-            similarity = 0.8
-            if similarity > best_similarity:
-                best_similarity = similarity
-                best_match_idx = idx
-    
-    # Only return if similarity is reasonable
-    if best_similarity > 0.3:
-        return best_match_idx
-    
-    return None
 
-def insert_marked_content_by_bbox(content_bytes, items_for_page):
+        choices[idx] = item_text
+
+    if not choices:
+        return None
+
+    # token_set_ratio covers the old exact/contains/starts-with
+    # heuristics in one C-level scorer; cutoff matches the old 0.3
+    match = process.extractOne(
+        text_block_text,
+        choices,
+        scorer=fuzz.token_set_ratio,
+        score_cutoff=30
+    )
+
+    if match is None:
+        return None
+
+    return match[2]
+
+def extract_page_texts(page):
+    """Extract the text of each BT...ET block via pikepdf's tokenizer.
+
+    parse_content_stream decodes string operands properly (escape
+    sequences, TJ arrays with kerning numbers), unlike the regex
+    fallback in extract_text_from_bt_et, and parses in one pass.
+    Returns one string per BT...ET block, in stream order.
+    """
+    texts = []
+    current = None
+
+    for operands, operator in pikepdf.parse_content_stream(page):
+        op = str(operator)
+
+        if op == "BT":
+            current = []
+        elif op == "ET":
+            if current is not None:
+                texts.append(' '.join(current).strip())
+            current = None
+        elif current is not None:
+            # Text-showing operators: Tj, ', " take a string operand;
+            # TJ takes an array of strings and kerning numbers
+            if op in ("Tj", "'", '"'):
+                if operands and isinstance(operands[-1], pikepdf.String):
+                    current.append(str(operands[-1]))
+            elif op == "TJ":
+                if operands:
+                    for element in operands[0]:
+                        if isinstance(element, pikepdf.String):
+                            current.append(str(element))
+
+    return texts
+
+
+def match_text_blocks(bt_et_texts, items_for_page):
+    """Match every text block on a page to a structure item in one shot.
+
+    Builds a char-3gram TF-IDF matrix over both sides and takes the top
+    cosine match per block from a single sparse multiply, instead of
+    scoring each block x item pair separately. Falls back to the
+    per-block find_best_match loop when vectorization fails (e.g. the
+    page has no usable text on one side).
+    """
+    candidate_texts = {}
+    for idx, item in enumerate(items_for_page):
+        if item["type"] == "Table":
+            continue  # Skip tables for now
+        item_text = item.get("text", "").strip()
+        if item_text:
+            candidate_texts[idx] = item_text
+
+    matched = [None] * len(bt_et_texts)
+
+    # Exact lowercase matches resolve in O(1) first; in practice most
+    # text blocks match their structure item verbatim
+    exact = {}
+    for idx, item_text in candidate_texts.items():
+        exact.setdefault(item_text.lower(), idx)
+
+    used = set()
+    for i, text in enumerate(bt_et_texts):
+        idx = exact.get(text.strip().lower())
+        if idx is not None and idx not in used:
+            matched[i] = idx
+            used.add(idx)
+
+    # Only the misses go through the fuzzy path
+    unresolved = [i for i, m in enumerate(matched) if m is None]
+    remaining = {idx: t for idx, t in candidate_texts.items() if idx not in used}
+
+    if not unresolved or not remaining:
+        return matched
+
+    try:
+        cand_indices = list(remaining)
+        vec = TfidfVectorizer(analyzer="char_wb", ngram_range=(3, 3))
+        vec.fit(list(remaining.values()) + [bt_et_texts[i] for i in unresolved if bt_et_texts[i]])
+        block_mat = vec.transform([bt_et_texts[i] for i in unresolved])
+        item_mat = vec.transform(remaining.values())
+
+        # (blocks x items) cosine matrix, keeping only the best match
+        # per block above the old 0.3 similarity floor
+        top = awesome_cossim_topn(block_mat, item_mat.T.tocsr(),
+                                  ntop=1, lower_bound=0.3).tocoo()
+
+        # Assign best scores first so no item is claimed twice
+        for score, row, col in sorted(zip(top.data, top.row, top.col), reverse=True):
+            i = unresolved[row]
+            item_idx = cand_indices[col]
+            if matched[i] is None and item_idx not in used:
+                matched[i] = item_idx
+                used.add(item_idx)
+
+        return matched
+    except Exception:
+        used_indices = set(used)
+        for i in unresolved:
+            matched_idx = find_best_match(bt_et_texts[i], items_for_page, used_indices)
+            if matched_idx is not None:
+                used_indices.add(matched_idx)
+                matched[i] = matched_idx
+        return matched
+
+
+def insert_marked_content_by_bbox(content_bytes, items_for_page, bt_et_texts=None):
     """
     Parse content stream and insert BDC/EMC around text blocks,
     matching them to structure items by content.
+
+    Works on bytes throughout; decoding/re-encoding the whole stream
+    would copy it twice for no benefit. bt_et_texts, when given, is
+    the per-block text from extract_page_texts; the regex extraction
+    is only used when it is missing or does not line up.
     """
-    try:
-        content_str = content_bytes.decode('latin-1')
-    except:
-        return content_bytes
-    
     # Find all BT...ET blocks
-    bt_et_pattern = r'(BT\s+.*?ET)'
-    matches = list(re.finditer(bt_et_pattern, content_str, re.DOTALL))
-    
+    matches = list(BT_ET_PATTERN.finditer(content_bytes))
+
     if not matches:
         return content_bytes
-    
-    # Extract text from each BT...ET block and match to structure items
-    text_block_matches = []
-    used_indices = set()
-    
-    for idx, match in enumerate(matches):
-        bt_et_text = extract_text_from_bt_et(match.group(0))
-        matched_idx = find_best_match(bt_et_text, items_for_page, used_indices)
-        
-        if matched_idx is not None:
-            used_indices.add(matched_idx)
-            text_block_matches.append((match, matched_idx))
-        else:
-            # No match found, skip this block
-            text_block_matches.append((match, None))
 
+    # Extract text from each BT...ET block and match to structure items
+    if bt_et_texts is None or len(bt_et_texts) != len(matches):
+        bt_et_texts = [extract_text_from_bt_et(m.group(0)) for m in matches]
+    text_block_matches = list(zip(matches, match_text_blocks(bt_et_texts, items_for_page)))
 
-    
-    # Build new content with marked content
-    new_content_parts = []
+    # Build new content with marked content. A single bytearray grows
+    # in place, avoiding the list of fragments plus final join pass.
+    new_content = bytearray()
+    out_extend = new_content.extend
     last_end = 0
-    
+
     for match, item_idx in text_block_matches:
         # Add content before this text block
-        new_content_parts.append(content_str[last_end:match.start()])
-        
+        out_extend(content_bytes[last_end:match.start()])
+
         if item_idx is not None:
             item = items_for_page[item_idx]
             tag_type = item["type"]
             mcid = item_idx
-            
+
             # Add BDC before BT
-            new_content_parts.append(f"/{tag_type} <</MCID {mcid}>> BDC\n")
+            out_extend(b"/%s <</MCID %d>> BDC\n" % (tag_type.encode('ascii'), mcid))
             # Add the text block itself
-            new_content_parts.append(match.group(0))
+            out_extend(match.group(0))
             # Add EMC after ET
-            new_content_parts.append("\nEMC")
+            out_extend(b"\nEMC")
         else:
             # No match, just add the text block without marking
-            new_content_parts.append(match.group(0))
-        
+            out_extend(match.group(0))
+
         last_end = match.end()
-    
+
     # Add remaining content
-    new_content_parts.append(content_str[last_end:])
-    
-    new_content = "".join(new_content_parts)
-    return new_content.encode('latin-1')
+    out_extend(content_bytes[last_end:])
+
+    return bytes(new_content)
 
 
 def apply_tagging(input_path, output_path, items):
@@ -328,6 +502,12 @@ def apply_tagging(input_path, output_path, items):
                 page_items[p] = []
             page_items[p].append(item)
         
+        # Streams rewritten in place so far, objgen -> pristine bytes.
+        # Pages can share a Contents stream (templated documents);
+        # later pages must read the original content and get their
+        # own stream rather than re-wrapping inserted BDC/EMC markers.
+        written_streams = {}
+
         # Process each page
         for page_idx in range(len(pdf.pages)):
             if page_idx not in page_items:
@@ -342,21 +522,48 @@ def apply_tagging(input_path, output_path, items):
             
             contents = page.Contents
             
-            # Get original content as bytes
+            # Get original content as bytes; join instead of += so
+            # multi-part Contents arrays don't copy quadratically.
+            # Streams this run has already rewritten are read from
+            # the saved pristine bytes instead. Direct streams have
+            # objgen (0, 0) and are never cached under that key.
             if isinstance(contents, Array):
-                original_content = b""
+                parts = []
                 for stream in contents:
-                    original_content += bytes(stream.read_bytes())
+                    cached = written_streams.get(stream.objgen) if stream.objgen != (0, 0) else None
+                    parts.append(cached if cached is not None else bytes(stream.read_bytes()))
+                original_content = b"".join(parts)
+                target = contents[0] if len(contents) > 0 else None
+                target_original = parts[0] if parts else None
             else:
-                original_content = bytes(contents.read_bytes())
+                cached = written_streams.get(contents.objgen) if contents.objgen != (0, 0) else None
+                original_content = cached if cached is not None else bytes(contents.read_bytes())
+                target = contents
+                target_original = original_content
             
-            # Insert marked content around text blocks
+            # Insert marked content around text blocks, matching on
+            # properly decoded operand text where the page parses
+            try:
+                bt_et_texts = extract_page_texts(page)
+            except Exception:
+                bt_et_texts = None
+
             items_for_page = page_items[page_idx]
-            new_content = insert_marked_content_by_bbox(original_content, items_for_page)
+            new_content = insert_marked_content_by_bbox(original_content, items_for_page, bt_et_texts)
             
-            # Create new content stream
-            new_stream = Stream(pdf, new_content)
-            page.Contents = new_stream
+            # Write back into the existing stream object where it is
+            # safe: first page to touch an indirect stream rewrites it
+            # in place (preserving object IDs) and records the
+            # pristine bytes. Shared streams seen again — and empty
+            # Contents arrays — get a fresh stream instead.
+            if (target is not None and target.objgen != (0, 0)
+                    and target.objgen not in written_streams):
+                written_streams[target.objgen] = target_original
+                target.write(new_content)
+                if isinstance(contents, Array):
+                    page.Contents = target
+            else:
+                page.Contents = Stream(pdf, new_content)
             
             print(f"Added {len(items_for_page)} marked content blocks to page {page_idx + 1}")
             
@@ -438,8 +645,14 @@ def apply_tagging(input_path, output_path, items):
                         print(f"Warning: Failed to create structure element: {e}")
 
         
-        # Save PDF
-        pdf.save(output_path)
+        # Save PDF. Object streams pack the many small StructElem
+        # objects created above, cutting output size substantially.
+        pdf.save(
+            output_path,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            compress_streams=True,
+            stream_decode_level=pikepdf.StreamDecodeLevel.generalized
+        )
         print(f"Successfully created tagged PDF with per-block content mapping")
 
 def main():
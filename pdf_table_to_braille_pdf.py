@@ -1,21 +1,32 @@
-import pdfplumber
+import fitz  # PyMuPDF
 import camelot
+import functools
 import subprocess
 import os
 import html
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
 from reportlab.lib.pagesizes import A4
 from reportlab.platypus import (
     SimpleDocTemplate,
     Paragraph,
     Spacer,
-    Table,
+    LongTable,
     TableStyle,
     PageBreak
 )
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib.colors import black, lightgrey
 
+try:
+    # Direct liblouis binding: the table loads once into the process
+    # and each translation is a C call instead of a subprocess
+    import louis
+except ImportError:
+    louis = None
+
 
 # ==============================
 # CONFIG
@@ -32,14 +43,15 @@ OUTPUT_PDF = "full_braille_document.pdf"
 # BRAILLE CONVERTER
 # ==============================
 
-def to_braille(text):
+# Rare sentinel used to batch many strings into one liblouis call
+BATCH_SEPARATOR = "\n⁣SEP⁣\n"
+
+
+def run_liblouis(text):
     """
-    Convert text → Grade 2 Braille using liblouis
+    Run lou_translate once and return its raw output
     """
 
-    if not text.strip():
-        return ""
-
     cmd = [
         LOU_PATH,
         "-f", BRAILLE_TABLE
@@ -56,7 +68,76 @@ def to_braille(text):
     if result.returncode != 0:
         raise Exception("liblouis error:\n" + result.stderr)
 
-    return result.stdout.strip()
+    return result.stdout
+
+
+@functools.lru_cache(maxsize=None)
+def to_braille(text):
+    """
+    Convert text → Grade 2 Braille using liblouis
+
+    Cached: repeated strings (headers, "Yes"/"No" cells, column
+    names) cost a dict lookup instead of a fresh process.
+    """
+
+    if not text.strip():
+        return ""
+
+    if louis is not None:
+        return louis.translateString([BRAILLE_TABLE], text).strip()
+
+    return run_liblouis(text).strip()
+
+
+def to_braille_batch(texts):
+    """
+    Convert many strings → Grade 2 Braille with ONE liblouis call.
+
+    Spawning lou_translate per line/cell dominates runtime, so all
+    strings are joined with a sentinel, translated together, and the
+    output is split back apart positionally.
+    """
+
+    results = ["" for _ in texts]
+
+    todo = [(i, t) for i, t in enumerate(texts) if t.strip()]
+
+    if not todo:
+        return results
+
+    # With the binding loaded there is no process startup to
+    # amortize, so plain (cached) per-string calls are fastest
+    if louis is not None:
+        for i, t in todo:
+            results[i] = to_braille(t)
+        return results
+
+    # Probe how the sentinel comes out of the translator so the
+    # combined output can be split on its translated form
+    sep_out = run_liblouis(BATCH_SEPARATOR).strip()
+
+    # Dedupe so every unique string is translated once
+    unique = {t: None for _, t in todo}
+
+    if sep_out:
+        joined = BATCH_SEPARATOR.join(unique)
+        parts = run_liblouis(joined).split(sep_out)
+
+        if len(parts) == len(unique):
+            for t, braille in zip(unique, parts):
+                unique[t] = braille.strip()
+            for i, t in todo:
+                results[i] = unique[t]
+            return results
+
+    # Sentinel not preserved — fall back to one call per string, but
+    # run them across threads: subprocess.run releases the GIL while
+    # waiting, so liblouis startup latency overlaps
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for (i, _), braille in zip(todo, executor.map(to_braille, (t for _, t in todo))):
+            results[i] = braille
+
+    return results
 
 
 # ==============================
@@ -67,15 +148,21 @@ def extract_text(pdf_path):
 
     pages = {}
 
-    with pdfplumber.open(pdf_path) as pdf:
+    doc = fitz.open(pdf_path)
 
-        for i, page in enumerate(pdf.pages):
+    for i, page in enumerate(doc):
 
-            text = page.extract_text()
+        # "blocks" yields (x0, y0, x1, y1, text, block_no, block_type)
+        # with text already split out in reading order — no big joined
+        # string to allocate and re-split; block_type 0 is text
+        blocks = page.get_text("blocks")
 
-            if text:
-                lines = text.split("\n")
-                pages[i + 1] = lines
+        lines = [b[4].rstrip("\n") for b in blocks if b[6] == 0]
+
+        if lines:
+            pages[i + 1] = lines
+
+    doc.close()
 
     return pages
 
@@ -84,20 +171,41 @@ def extract_text(pdf_path):
 # TABLE EXTRACTION
 # ==============================
 
+def _camelot_range(pdf_path, pages):
+    """
+    Worker: run Camelot on one page range, return (page, df) pairs
+    """
+
+    tables = camelot.read_pdf(pdf_path, pages=pages)
+
+    return [(int(t.page), t.df) for t in tables]
+
+
 def extract_tables(pdf_path):
 
-    tables = camelot.read_pdf(pdf_path, pages="all")
+    doc = fitz.open(pdf_path)
+    num_pages = doc.page_count
+    doc.close()
+
+    # pages="all" runs serially inside Camelot; split the document
+    # into small ranges and extract them across processes instead
+    chunks = [
+        f"{start + 1}-{min(start + 4, num_pages)}"
+        for start in range(0, num_pages, 4)
+    ]
 
     page_tables = {}
 
-    for t in tables:
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+
+        for results in executor.map(_camelot_range, repeat(pdf_path), chunks):
 
-        page_no = int(t.page)
+            for page_no, df in results:
 
-        if page_no not in page_tables:
-            page_tables[page_no] = []
+                if page_no not in page_tables:
+                    page_tables[page_no] = []
 
-        page_tables[page_no].append(t.df)
+                page_tables[page_no].append(df)
 
     return page_tables
 
@@ -120,8 +228,47 @@ def build_pdf(text_pages, table_pages, output_file):
     styles = getSampleStyleSheet()
     story = []
 
+    # Shared immutable styles — build once, reuse for every
+    # paragraph and table
+    normal_style = styles["Normal"]
+
+    table_style = TableStyle([
+
+        ("GRID", (0,0), (-1,-1), 0.4, black),
+
+        ("BACKGROUND", (0,0), (-1,0), lightgrey),
+
+        ("FONT", (0,0), (-1,-1), "Helvetica", 8),
+
+        ("ALIGN", (0,0), (-1,-1), "LEFT"),
+
+        ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
+
+        ("TOPPADDING", (0,0), (-1,-1), 5),
+        ("BOTTOMPADDING", (0,0), (-1,-1), 5),
+    ])
+
     all_pages = sorted(set(text_pages) | set(table_pages))
 
+    # ----------------------
+    # BRAILLE (BATCHED)
+    # ----------------------
+    # Collect every line and cell first so liblouis runs once for
+    # the whole document instead of once per string
+    all_inputs = []
+
+    for page in all_pages:
+
+        if page in text_pages:
+            all_inputs.extend(text_pages[page])
+
+        if page in table_pages:
+            for df in table_pages[page]:
+                for row in df.values:
+                    all_inputs.extend(str(cell) for cell in row)
+
+    braille_outputs = iter(to_braille_batch(all_inputs))
+
     for page in all_pages:
 
         # ----------------------
@@ -131,11 +278,11 @@ def build_pdf(text_pages, table_pages, output_file):
 
             for line in text_pages[page]:
 
-                braille = to_braille(line)
+                braille = next(braille_outputs)
 
                 safe_text = html.escape(braille)
 
-                story.append(Paragraph(safe_text, styles["Normal"]))
+                story.append(Paragraph(safe_text, normal_style))
                 story.append(Spacer(1, 6))
 
 
@@ -154,9 +301,7 @@ def build_pdf(text_pages, table_pages, output_file):
 
                     for cell in row:
 
-                        cell_text = str(cell)
-
-                        cell_braille = to_braille(cell_text)
+                        cell_braille = next(braille_outputs)
 
                         safe_cell = html.escape(cell_braille)
 
@@ -165,27 +310,15 @@ def build_pdf(text_pages, table_pages, output_file):
                     braille_data.append(braille_row)
 
 
-                table = Table(
+                # LongTable lays out row by row instead of
+                # recomputing column widths over the whole table
+                table = LongTable(
                     braille_data,
                     repeatRows=1,
                     hAlign="LEFT"
                 )
 
-                table.setStyle(TableStyle([
-
-                    ("GRID", (0,0), (-1,-1), 0.4, black),
-
-                    ("BACKGROUND", (0,0), (-1,0), lightgrey),
-
-                    ("FONT", (0,0), (-1,-1), "Helvetica", 8),
-
-                    ("ALIGN", (0,0), (-1,-1), "LEFT"),
-
-                    ("VALIGN", (0,0), (-1,-1), "MIDDLE"),
-
-                    ("TOPPADDING", (0,0), (-1,-1), 5),
-                    ("BOTTOMPADDING", (0,0), (-1,-1), 5),
-                ]))
+                table.setStyle(table_style)
 
                 story.append(table)
                 story.append(Spacer(1, 20))
@@ -211,7 +344,7 @@ def main():
     if not os.path.exists(INPUT_PDF):
         raise FileNotFoundError("input.pdf not found")
 
-    if not os.path.exists(LOU_PATH):
+    if louis is None and not os.path.exists(LOU_PATH):
         raise FileNotFoundError("lou_translate.exe not found")
 
     print("\nExtracting text...")
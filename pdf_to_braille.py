@@ -1,8 +1,15 @@
-import pdfplumber
+import fitz  # PyMuPDF
+import functools
 import subprocess
 import os
 import sys
 
+try:
+    # Direct liblouis binding — translation without a subprocess
+    import louis
+except ImportError:
+    louis = None
+
 
 def pdf_to_text(pdf_path):
     """
@@ -13,20 +20,29 @@ def pdf_to_text(pdf_path):
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
+    doc = fitz.open(pdf_path)
+
+    for page in doc:
+        page_text = page.get_text("text")
+
+        if page_text:
+            text += page_text + "\n"
 
-            if page_text:
-                text += page_text + "\n"
+    doc.close()
 
     return text
 
+@functools.lru_cache(maxsize=None)
 def text_to_braille(text, table="en-us-g2.ctb"):
     """
     Convert text to Braille using liblouis CLI
+
+    Cached so repeated inputs skip the subprocess launch
     """
 
+    if louis is not None:
+        return louis.translateString([table], text)
+
     LOU_PATH = r"liblouis-3.36.0-win32\bin\lou_translate.exe"
 
     if not os.path.exists(LOU_PATH):